@@ -1,34 +1,81 @@
+import collections
+import functools
 import inspect
+import weakref
 
 import numpy as np
 
 import System
 
+try:
+    import numba
+except ImportError:  # numba is only needed for InterAction.jit
+    numba = None
+
+# Validate the signatures of user functions when an InterAction is created.
+# Disabled under python -O, or by setting it to False for trusted code.
+STRICT_VALIDATION = __debug__
+
+
+# Signatures of the functions validated so far, dropped along with the functions
+_SIGNATURE_CACHE = weakref.WeakKeyDictionary()
+
+
+def _inspect_params(func):
+    signature = inspect.signature(func)
+    params = tuple(
+        (param.name, param.kind, param.annotation, param.default)
+        for param in signature.parameters.values()
+    )
+    return params, signature.return_annotation
+
+
+def _signature_params(func):
+    """
+    Inspect the signature of a function once and cache the result.
+
+    Callables that are unhashable or cannot be weakly referenced are inspected on every call.
+
+    :param func: The function to inspect.
+    :return: A tuple of (name, kind, annotation, default) for each parameter and the return annotation.
+    """
+    try:
+        return _SIGNATURE_CACHE[func]
+    except KeyError:
+        pass
+    except TypeError:
+        return _inspect_params(func)
+    result = _inspect_params(func)
+    try:
+        _SIGNATURE_CACHE[func] = result
+    except TypeError:
+        pass
+    return result
+
 
 def _validate_update_function(update_func):
     if update_func:
-        updater_signature = inspect.signature(update_func)
-        updater_params = updater_signature.parameters
+        updater_params, return_annotation = _signature_params(update_func)
         assert (
             len(updater_params) == 2
         ), "Updater function must accept two parameters: (System, maps)"
-        assert updater_signature.return_annotation in [
+        assert return_annotation in [
             np.ndarray,
+            getattr(System.cupy, "ndarray", np.ndarray),
             None,
-        ], "Updater must return a numpy ndarray or None"
+        ], "Updater must return an ndarray or None"
 
 
 def _validate_map_function(map_func):
-    mf_signature = inspect.signature(map_func)
-    mf_params = mf_signature.parameters
+    mf_params, _ = _signature_params(map_func)
     assert (
         len(mf_params) == 3
     ), "Map function must accept three parameters: (int, int, System)"
 
 
 def _check_first_three_params(params, expected_types):
-    param_names = list(params)[:3]
-    param_types = [params[name].annotation for name in param_names]
+    param_names = [param[0] for param in params[:3]]
+    param_types = [param[2] for param in params[:3]]
     for i, expected_type in enumerate(expected_types):
         assert (
             param_types[i] == expected_type
@@ -36,24 +83,73 @@ def _check_first_three_params(params, expected_types):
 
 
 def _check_keyword_params(params, kwargs):
-    for param_name, param in params.items():
-        if param.kind == inspect.Parameter.KEYWORD_ONLY:
+    for name, kind, _, default in params:
+        if kind == inspect.Parameter.KEYWORD_ONLY:
             assert (
-                param_name in kwargs
-            ), f"Missing keyword argument: {param_name} required by the rate function"
-            if param.default is not inspect.Parameter.empty:
+                name in kwargs
+            ), f"Missing keyword argument: {name} required by the rate function"
+            if default is not inspect.Parameter.empty:
                 assert (
-                    kwargs[param_name] == param.default
-                ), f"Default value for {param_name} does not match"
+                    kwargs[name] == default
+                ), f"Default value for {name} does not match"
 
 
 def _validate_rate_function(rate_func, kwargs):
-    rf_signature = inspect.signature(rate_func)
-    rf_params = rf_signature.parameters
+    rf_params, _ = _signature_params(rate_func)
     _check_first_three_params(rf_params, expected_types=[int, int, System.System])
     _check_keyword_params(rf_params, kwargs)
 
 
+def _validate_rate_vec_function(rate_func_vec, kwargs):
+    if rate_func_vec:
+        rv_params, _ = _signature_params(rate_func_vec)
+        positional = [p for p in rv_params if p[1] != inspect.Parameter.KEYWORD_ONLY]
+        assert (
+            len(positional) == 1
+        ), "Vectorized rate function must accept one positional parameter: (System)"
+        _check_keyword_params(rv_params, kwargs)
+
+
+if numba is not None:
+
+    # Not cached on disk: the type of the kernel argument differs in every process,
+    # so a cached version would never be reused
+    @numba.njit
+    def _jit_rate_matrix(kernel, nodes, adj):
+        n = nodes.shape[0]
+        rates = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                rates[i, j] = kernel(i, j, nodes, adj)
+        return rates
+
+
+class _LocalRateCache:
+    """
+    LRU cache of rates keyed on the state of the two nodes and the edge between them.
+
+    Only valid for rate functions that depend on nothing else. Since the key is the state
+    itself, entries never go stale and need no invalidation.
+    """
+
+    def __init__(self, func, maxsize=2**16):
+        self.func = func
+        self.maxsize = maxsize
+        self.rates = collections.OrderedDict()
+
+    def __call__(self, i: int, j: int, S: System.System):
+        key = (S.local_state_key(i), S.local_state_key(j), int(S.adj[i, j]))
+        rates = self.rates
+        rate = rates.get(key)
+        if rate is not None:
+            rates.move_to_end(key)
+            return rate
+        rate = rates[key] = self.func(i, j, S)
+        if len(rates) > self.maxsize:
+            rates.popitem(last=False)
+        return rate
+
+
 class InterAction:
     """
     Represents an interaction within a system, encompassing a rate function,
@@ -62,22 +158,84 @@ class InterAction:
     The rate function determines the probability or rate of interaction between nodes.
     The map function defines how the state of the system changes due to an interaction.
     The updater function, if provided, updates a boolean matrix indicating elements that need updating.
+    The vectorized rate function, if provided, returns the NxN matrix of rates in a single call.
     """
 
-    def __init__(self, *, rate_func, map_func, update_func=None, **kwargs):
+    def __init__(
+        self,
+        *,
+        rate_func,
+        map_func,
+        update_func=None,
+        rate_func_vec=None,
+        local_rates=False,
+        **kwargs,
+    ):
         """
         Initializes the interaction with given functions and parameters.
+
+        Set local_rates if the rate between i and j only depends on the properties of i and j
+        and on the edge between them; rates are then memoized on that local state.
         """
-        _validate_rate_function(rate_func, kwargs)
-        _validate_map_function(map_func)
-        _validate_update_function(update_func)
+        if STRICT_VALIDATION:
+            _validate_rate_function(rate_func, kwargs)
+            _validate_map_function(map_func)
+            _validate_update_function(update_func)
+            _validate_rate_vec_function(rate_func_vec, kwargs)
+        self._jit_kernel = getattr(rate_func, "jit_kernel", None)
+        assert (
+            self._jit_kernel is None or not kwargs
+        ), "Rate functions compiled with InterAction.jit do not accept keyword arguments"
         self.rate_func = rate_func
         self.map_func = map_func
         self.update_func = update_func
+        self.rate_func_vec = rate_func_vec
         self.kwargs = kwargs
 
+        # Bind the keyword arguments once so the hot path is a plain call
+        self._call = functools.partial(rate_func, **kwargs) if kwargs else rate_func
+        if local_rates:
+            self._call = _LocalRateCache(self._call)
+        self._call_vec = None
+        if rate_func_vec is not None:
+            self._call_vec = (
+                functools.partial(rate_func_vec, **kwargs) if kwargs else rate_func_vec
+            )
+        self._has_update = update_func is not None
+        # Unless a subclass overrides it, get_propensity is the bound callable itself
+        if type(self).get_propensity is InterAction.get_propensity:
+            self.get_propensity = self._call
+
         self.n_body = 2  # number of bodies
 
+    @staticmethod
+    def jit(kernel):
+        """
+        Compile a rate kernel with numba so that it can be used as a rate function.
+
+        The kernel takes (i, j, nodes, adj) instead of (i, j, S) so that it can be
+        compiled in nopython mode. numba keeps one specialization per dtype of the
+        nodes and adjacency arrays.
+
+        :param kernel: A function (int, int, np.ndarray, np.ndarray) -> float.
+        :return: A rate function (int, int, System) wrapping the compiled kernel.
+        """
+        if numba is None:
+            raise ImportError("InterAction.jit requires numba to be installed")
+        try:
+            compiled = numba.njit(cache=True)(kernel)
+        except RuntimeError:
+            # Kernels defined outside a file (REPL, exec) cannot be cached on disk
+            compiled = numba.njit(kernel)
+
+        def rate_func(i: int, j: int, S: System.System):
+            return compiled(i, j, S.nodes, S.adj)
+
+        rate_func.__name__ = kernel.__name__
+        rate_func.__doc__ = kernel.__doc__
+        rate_func.jit_kernel = compiled
+        return rate_func
+
     # Other parts of the class remain unchanged ...
 
     def get_propensity(self, i: int, j: int, S: System.System):
@@ -89,10 +247,32 @@ class InterAction:
         :param S: The current state of the system.
         :return: The calculated interaction rate.
         """
-        if self.kwargs:
-            return self.rate_func(i, j, S, **self.kwargs)
-        else:
-            return self.rate_func(i, j, S)
+        return self._call(i, j, S)
+
+    def get_propensity_matrix(self, S: System.System):
+        """
+        Calculate the interaction rates between all pairs of nodes.
+
+        Uses the vectorized rate function when provided, then the compiled kernel of a
+        rate function built with InterAction.jit, and otherwise falls back to
+        evaluating the rate function on every pair i < j.
+
+        :param S: The current state of the system.
+        :return: An NxN numpy array of rates, of which only the upper triangle (i < j) is used.
+        """
+        if self._call_vec is not None:
+            return self._call_vec(S)
+        if self._jit_kernel is not None:
+            if S.is_sparse() or S.xp is not np:
+                raise TypeError(
+                    "Rate functions compiled with InterAction.jit require dense numpy arrays"
+                )
+            return _jit_rate_matrix(self._jit_kernel, S.nodes, S.adj)
+        n = S.get_size()
+        rates = np.zeros((n, n))
+        for i, j in zip(*np.triu_indices(n, k=1)):
+            rates[i, j] = self.get_propensity(int(i), int(j), S)
+        return rates
 
     def get_map(self, i: int, j: int, S: System.System):
         """
@@ -112,14 +292,12 @@ class InterAction:
         :param S: The current state of the system.
         :param maps: The interaction maps to be applied.
         :return: A matrix that tells you which elements of the interaction matrix needs updating or None if no updater function is provided.
+            It may be a numpy array or an array of the system's backend, S.xp.
         """
-        if self.update_func:
-            result = self.update_func(S, maps)
-            assert (
-                isinstance(result, np.ndarray) and result.ndim == 2
-            ) or result is None, (
-                "Updater function must return a 2D numpy ndarray or None"
-            )
-            return result
-        else:
+        if not self._has_update:
             return None
+        result = self.update_func(S, maps)
+        assert (
+            result is None or getattr(result, "ndim", None) == 2
+        ), "Updater function must return a 2D array or None"
+        return result
@@ -1,3 +1,5 @@
+import functools
+import math
 from typing import List
 import numpy as np
 
@@ -5,6 +7,29 @@ from Code.System import System
 from InterAction import InterAction
 
 
+def _array2string(xp, arr, threshold=50, edgeitems=3):
+    """
+    Format an array of the backend, copying to the host only the elements that are printed.
+
+    :param xp: The array module of arr.
+    :param arr: The array to format.
+    :param threshold: Arrays with more elements than this are summarized, as in np.array2string.
+    :param edgeitems: Number of leading and trailing items shown along each summarized axis.
+    :return: The same string as np.array2string would give for the whole array on the host.
+    """
+    if xp is np:
+        return np.array2string(arr, threshold=threshold, edgeitems=edgeitems)
+    if arr.size <= threshold:
+        return np.array2string(arr.get(), threshold=threshold, edgeitems=edgeitems)
+    # Keep one element between the leading and trailing items so that the axis is
+    # still summarized; numpy drops it and formats the edges only
+    for axis, length in enumerate(arr.shape):
+        if length > 2 * edgeitems + 1:
+            keep = np.r_[:edgeitems, length // 2, length - edgeitems : length]
+            arr = xp.take(arr, xp.asarray(keep), axis=axis)
+    return np.array2string(arr.get(), threshold=0, edgeitems=edgeitems)
+
+
 class Model:
     def __init__(
         self,
@@ -12,19 +37,27 @@ class Model:
         nodes: np.ndarray,
         adj: np.ndarray = None,
         method="gillespie_direct",
+        debug=False,
+        node_dtype=None,
+        backend="numpy",
+        copy=True,
     ):
+        # The exact type check is cheaper and only falls back to isinstance for subclasses
         if not all(
-            isinstance(interaction, InterAction) for interaction in interactions
+            type(interaction) is InterAction or isinstance(interaction, InterAction)
+            for interaction in interactions
         ):
             raise TypeError(
                 "All elements in interactions should be an instance of InterAction"
             )
 
         self.time = 0
-        self.system = System(nodes, adj)
+        self.system = System(nodes, adj, node_dtype, backend, copy)
         self.interactions = interactions
 
         self.method = method
+        # Validate every map before it is applied, at the cost of speed
+        self.debug = debug
         self.simulation = self._initialize_simulation()
 
     def _initialize_simulation(self):
@@ -34,10 +67,46 @@ class Model:
         else:
             raise ValueError(f"Unknown simulation method: {self.method}")
 
+    def step(self):
+        """
+        Advance the simulation by a single event.
+
+        :return: The maps that were applied, or None if no event can occur.
+        """
+        return self.simulation.step()
+
+    def run(self, t_max):
+        """
+        Advance the simulation until the time reaches t_max or no event can occur.
+
+        :param t_max: The time at which to stop the simulation.
+        """
+        while self.time < t_max:
+            event = self.simulation.draw()
+            if event is None:
+                break
+            # The next event happens after t_max, so the state at t_max is the current one
+            if self.time + event[0] > t_max:
+                self.time = t_max
+                break
+            self.simulation.apply(*event)
+
     def __str__(self):
-        node_str = np.array2string(self.system.nodes)
-        adj_str = np.array2string(self.system.adj)
-        return f"System\nNodes:\n{node_str}\nAdjacency matrix:\n{adj_str}"
+        # Large arrays are summarized instead of formatting every element
+        xp = self.system.xp
+        nodes, adj = self.system.nodes, self.system.adj
+        node_str = _array2string(xp, nodes)
+        if self.system.is_sparse():
+            nnz = adj.count_nonzero()
+            adj_str = str(adj)
+        else:
+            nnz = int(xp.count_nonzero(adj))
+            adj_str = _array2string(xp, adj)
+        n, d = nodes.shape
+        return (
+            f"System\nNodes ({n}x{d}):\n{node_str}\n"
+            f"Adjacency matrix ({n}x{n}, nnz={nnz}):\n{adj_str}"
+        )
 
 
 # how can we ensure that the signature is always the same (is all this switching back and forth costing me time)
@@ -48,5 +117,164 @@ class Model:
 
 
 class GillespieSimulation:
+    """
+    Gillespie direct method over every pair of nodes (i < j) for every interaction.
+    """
+
     def __init__(self, model: Model, system: System, interactions: List[InterAction]):
-        x = 0
+        self.model = model
+        self.system = system
+        self.interactions = interactions
+        self.rng = np.random.default_rng()
+        # The rates live with the system's arrays, on the GPU for the cupy backend
+        self.xp = xp = system.xp
+
+        # Only the upper triangle is considered so that each pair is counted once
+        n = system.get_size()
+        self._n = n
+        self._n_pairs = n * (n - 1) // 2
+        # Selects the pairs i < j of an NxN rate matrix in row-major order
+        self._upper = xp.triu(xp.ones((n, n), dtype=bool), k=1)
+
+        # Rates with one block of N(N-1)/2 per interaction, in the order of _upper.
+        # Blocks of interactions with an updater are refreshed only where it asks for it
+        self._rates = xp.full(len(interactions) * self._n_pairs, np.nan)
+        self._blocks = [
+            self._rates[k * self._n_pairs : (k + 1) * self._n_pairs]
+            for k in range(len(interactions))
+        ]
+        self._last_maps = None
+
+        # The set of interactions is fixed, so the rate computation is generated once
+        self._compute_rates = self._build_compute_rates()
+
+    def _pair(self, p: int):
+        """
+        Get the nodes of a pair from its position in a block of rates.
+
+        :param p: Position of the pair, in the row-major order of the pairs i < j.
+        :return: The indices (i, j) of the two nodes.
+        """
+        n = self._n
+        i = n - 2 - math.floor(math.sqrt(4 * n * (n - 1) - 8 * p - 7) / 2 - 0.5)
+        j = p + i + 1 - self._n_pairs + (n - i) * (n - i - 1) // 2
+        return i, j
+
+    def _refresh_rates(self, k: int, interaction: InterAction):
+        """
+        Bring the cached rates of an interaction up to date with the system.
+
+        All rates are recomputed on the first step and for interactions without an
+        updater function; otherwise only the pairs flagged by the updater are.
+
+        :param k: Index of the interaction.
+        :param interaction: The interaction whose rates are refreshed.
+        """
+        block = self._blocks[k]
+        mask = None
+        if self._last_maps is not None:
+            mask = interaction.get_update_matrix(self.system, self._last_maps)
+        if mask is None:
+            rates = self.xp.asarray(interaction.get_propensity_matrix(self.system))
+            block[:] = rates[self._upper]
+            return
+        xp, n = self.xp, self._n
+        mask = xp.asarray(mask)
+        # The flagged pairs are found on the backend, only their indices are copied
+        pairs = xp.argwhere(xp.triu(mask | mask.T, k=1))
+        if xp is not np:
+            pairs = pairs.get()
+        for i, j in pairs:
+            p = i * (2 * n - i - 1) // 2 + j - i - 1
+            block[p] = interaction.get_propensity(int(i), int(j), self.system)
+
+    def _build_compute_rates(self):
+        """
+        Generate a function computing the rates of all possible events.
+
+        The loop over the interactions is unrolled with every rate function bound to
+        its own name. Interactions without an updater function write their full rate
+        matrix straight into their block, the others go through _refresh_rates.
+
+        :return: A function returning a flat array with one block of N(N-1)/2 rates per interaction.
+        """
+        namespace = {
+            "system": self.system,
+            "rates": self._rates,
+            "upper": self._upper,
+            "asarray": self.xp.asarray,
+        }
+        lines = ["def _compute_rates():"]
+        for k, interaction in enumerate(self.interactions):
+            if interaction._has_update:
+                namespace[f"refresh_{k}"] = functools.partial(
+                    self._refresh_rates, k, interaction
+                )
+                lines.append(f"    refresh_{k}()")
+                continue
+            namespace[f"block_{k}"] = self._blocks[k]
+            if interaction._call_vec is not None:
+                namespace[f"rates_{k}"] = interaction._call_vec
+            else:
+                namespace[f"rates_{k}"] = interaction.get_propensity_matrix
+            if self.xp is np:
+                lines.append(f"    block_{k}[:] = rates_{k}(system)[upper]")
+            else:
+                lines.append(f"    block_{k}[:] = asarray(rates_{k}(system))[upper]")
+        lines.append("    return rates")
+
+        source = "\n".join(lines)
+        exec(compile(source, "<GillespieSimulation._compute_rates>", "exec"), namespace)
+        return namespace["_compute_rates"]
+
+    def draw(self):
+        """
+        Select the next event without applying it.
+
+        :return: A tuple (dt, k, i, j) with the waiting time, the index of the interaction and the
+            pair of nodes, or None if no event can occur.
+        """
+        # A single cumulative pass gives both the total rate and the search table
+        xp = self.xp
+        rates = self._compute_rates()
+        if self.model.debug and not (xp.isfinite(rates).all() and (rates >= 0).all()):
+            raise ValueError("Rate functions must return finite, non-negative rates")
+        cumulative = xp.cumsum(rates)
+        if cumulative.size == 0 or cumulative[-1] <= 0:
+            return None
+        total = float(cumulative[-1])
+
+        dt = self.rng.exponential(1 / total)
+        target = xp.asarray(self.rng.random() * total)
+        event = int(xp.searchsorted(cumulative, target, side="right"))
+        k, pair = divmod(event, self._n_pairs)
+        return (dt, k) + self._pair(pair)
+
+    def apply(self, dt, k: int, i: int, j: int):
+        """
+        Apply an event selected by draw and advance the time.
+
+        :param dt: The waiting time before the event.
+        :param k: Index of the interaction.
+        :param i: Index of the first node.
+        :param j: Index of the second node.
+        :return: The maps that were applied.
+        """
+        maps = self.interactions[k].get_map(i, j, self.system)
+        if self.model.debug:
+            self.system.check_maps(maps)
+        self.system.apply_maps(maps)
+        self._last_maps = maps
+        self.model.time += dt
+        return maps
+
+    def step(self):
+        """
+        Select and apply a single event.
+
+        :return: The maps that were applied, or None if no event can occur.
+        """
+        event = self.draw()
+        if event is None:
+            return None
+        return self.apply(*event)
@@ -1,46 +1,226 @@
 import numpy as np
 
+try:
+    import scipy.sparse as sparse
+except ImportError:  # scipy is only needed for sparse adjacency matrices
+    sparse = None
+
+try:
+    import numba
+except ImportError:  # numba is only needed to compile _apply_edge_ops
+    numba = None
+
+try:
+    import cupy
+except ImportError:  # cupy is only needed for the "cupy" backend
+    cupy = None
+
+# Op codes of maps encoded as arrays, see System.apply_encoded_maps
+ADD_EDGE = 0
+REMOVE_EDGE = 1
+CHANGE_NODE_PROPERTY = 2
+OP_CODES = {"+": ADD_EDGE, "-": REMOVE_EDGE, "np": CHANGE_NODE_PROPERTY}
+
+
+def _add_edge_impl(adj, n1, n2):
+    if n1 == n2:
+        raise ValueError("Cannot connect a node to itself")
+    # adj is kept symmetric, so a single entry tells whether the edge exists.
+    # The check is skipped when running with python -O.
+    if __debug__ and adj[n1, n2]:
+        raise ValueError("Attempting to add an edge that is already present")
+    adj[n1, n2] += 1
+    adj[n2, n1] += 1
+
+
+def _remove_edge_impl(adj, n1, n2):
+    if n1 == n2:
+        raise ValueError("Cannot disconnect a node from itself")
+    if __debug__ and not adj[n1, n2]:
+        raise ValueError("Attempting to remove an edge that doesn't exist")
+    adj[n1, n2] -= 1
+    adj[n2, n1] -= 1
+
+
+def _apply_edge_ops_py(adj, ops, args):
+    for k in range(ops.size):
+        if ops[k] == ADD_EDGE:
+            _add_edge_impl(adj, args[k, 0], args[k, 1])
+        elif ops[k] == REMOVE_EDGE:
+            _remove_edge_impl(adj, args[k, 0], args[k, 1])
+        else:
+            raise ValueError("Only edge maps can be applied from encoded arrays")
+
+
+# Dense adjacency matrices go through the compiled loop when numba is available.
+# It refers to the compiled edge functions as globals so that it can be cached on disk.
+# The cache does not track the callees' __debug__ checks, so python -O runs compile without it.
+if numba is not None:
+    _add_edge_jit = numba.njit(cache=__debug__)(_add_edge_impl)
+    _remove_edge_jit = numba.njit(cache=__debug__)(_remove_edge_impl)
+
+    @numba.njit(cache=__debug__)
+    def _apply_edge_ops(adj, ops, args):
+        for k in range(ops.size):
+            if ops[k] == ADD_EDGE:
+                _add_edge_jit(adj, args[k, 0], args[k, 1])
+            elif ops[k] == REMOVE_EDGE:
+                _remove_edge_jit(adj, args[k, 0], args[k, 1])
+            else:
+                raise ValueError("Only edge maps can be applied from encoded arrays")
+
+else:
+    _apply_edge_ops = _apply_edge_ops_py
+
 
 class System:
     """
     A class representing a symmetric network with pairwise interactions.
     """
 
-    def __init__(self, nodes: np.ndarray, adj: np.ndarray = None):
+    def __init__(
+        self,
+        nodes: np.ndarray,
+        adj: np.ndarray = None,
+        node_dtype=None,
+        backend="numpy",
+        copy=True,
+    ):
         """
         Initialize the system with nodes and an adjacency matrix.
 
-        :param nodes: A 2D numpy array representing the nodes (NxD).
-        :param adj: A 2D numpy array representing the adjacency matrix (NxN). Defaults to an identity matrix.
+        :param nodes: A 2D numpy array representing the nodes (NxD). Each property is also available as a
+            contiguous 1D array in node_props.
+        :param adj: A 2D numpy array or scipy sparse matrix representing the adjacency matrix (NxN). Defaults to an identity matrix.
+            Sparse matrices are stored in LIL format so that edges can be added and removed in place.
+            The adjacency matrix is stored as int8 since it only holds edge counts.
+        :param node_dtype: The dtype used to store the nodes, e.g. np.int8 for categorical properties.
+            Defaults to the dtype of nodes.
+        :param backend: "numpy" to keep the arrays in host memory, or "cupy" to keep them on the GPU. The array
+            module in use is available as xp, so that vectorized rate functions can be written for both.
+            The cupy backend is experimental.
+        :param copy: Copy nodes and adj, which the maps update in place. If False, arrays that already have
+            the expected dtype and layout (Fortran order for nodes, int8 for adj) become the state of the
+            system without a copy, and must not be shared with another system.
         """
-        self.nodes = np.array(nodes)
-        n = len(self.nodes)
+        if backend == "numpy":
+            self.xp = np
+        elif backend == "cupy":
+            if cupy is None:
+                raise ImportError('The "cupy" backend requires cupy to be installed')
+            self.xp = cupy
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+        xp = self.xp
+        convert = xp.array if copy else xp.asarray
+
+        # Column-major storage keeps every property contiguous in memory
+        self.nodes = convert(nodes, dtype=node_dtype, order="F")
 
         # Assert that it is a 2D array
         assert len(self.nodes.shape) == 2, "Nodes should be a 2D array (NxD)"
+        # The number of nodes and properties never change, so they are cached
+        self._n, self._d = self.nodes.shape
+        n = self._n
+
+        # One contiguous 1D view per property, sharing memory with self.nodes
+        self.node_props = [self.nodes[:, k] for k in range(self._d)]
 
+        self._sparse = sparse is not None and sparse.issparse(adj)
         if adj is None:
-            self.adj = np.eye(n)
+            self.adj = xp.eye(n, dtype=np.int8)
+            lossy = False
+        elif self._sparse:
+            if xp is not np:
+                raise ValueError("Sparse adjacency matrices require the numpy backend")
+            self.adj = sparse.lil_matrix(adj, dtype=np.int8, copy=copy)
+            lossy = (self.adj != adj).nnz != 0
         else:
-            self.adj = np.array(adj)
-            # Assert that adj is a square matrix and its size matches the number of nodes
-            assert self.adj.shape == (
-                n,
-                n,
-            ), "Adjacency matrix should be of size NxN and match the number of nodes"
+            original = xp.asarray(adj)
+            self.adj = convert(adj, dtype=np.int8)
+            lossy = not xp.array_equal(self.adj, original)
+        # adj is stored as int8, refuse values the cast would change
+        if lossy:
+            raise ValueError(
+                "Adjacency matrix entries must be integers in the int8 range"
+            )
+        # Assert that adj is a square matrix and its size matches the number of nodes
+        assert self.adj.shape == (
+            n,
+            n,
+        ), "Adjacency matrix should be of size NxN and match the number of nodes"
 
         self.maps = {
             "+": self._add_edge,
             "-": self._remove_edge,
             "np": self._change_node_property,
         }
+        # Map instructions may use either the string key or its op code (see OP_CODES)
+        self._dispatch = {
+            **self.maps,
+            **{OP_CODES[key]: func for key, func in self.maps.items()},
+        }
+        # Number of arguments of each map function, -1 to exclude 'self'
+        self._map_arity = {
+            key: func.__code__.co_argcount - 1 for key, func in self._dispatch.items()
+        }
 
     def apply_maps(self, maps):
         """
         Apply a series of maps to the system.
 
-        :param maps: A list of lists where each inner list contains the map key and its parameters.
+        The maps are not validated here; use check_maps to validate them first.
+
+        :param maps: A list of lists where each inner list contains the map key (or its op code) and its parameters,
+            or a tuple (ops, args) of edge maps encoded as arrays (see apply_encoded_maps).
+        """
+        if isinstance(maps, tuple):
+            self.apply_encoded_maps(*maps)
+            return
+        dispatch = self._dispatch
+        for key, args in maps:
+            dispatch[key](*args)
+
+    def apply_encoded_maps(self, ops, args):
+        """
+        Apply a series of edge maps encoded as arrays.
+
+        :param ops: A 1D int8 array of op codes, ADD_EDGE or REMOVE_EDGE.
+        :param args: An (M, 2) integer array holding the two nodes of each edge.
+        """
+        # The compiled loop does not check bounds, so out of range nodes are rejected here
+        if args.size and (args.min() < 0 or args.max() >= self._n):
+            raise IndexError("Node index out of range in encoded maps")
+        if self._sparse or self.xp is not np:
+            _apply_edge_ops_py(self.adj, ops, args)
+        else:
+            _apply_edge_ops(self.adj, ops, args)
+
+    def check_maps(self, maps):
+        """
+        Check that a series of maps is well formed before it is applied.
+
+        :param maps: A list of lists where each inner list contains the map key and its parameters,
+            or a tuple (ops, args) of edge maps encoded as arrays.
         """
+        if isinstance(maps, tuple):
+            assert len(maps) == 2, "Encoded maps should be a tuple (ops, args)"
+            ops, args = maps
+            assert (
+                isinstance(ops, np.ndarray) and ops.ndim == 1
+            ), "ops should be a 1D numpy array"
+            assert isinstance(args, np.ndarray) and args.shape == (
+                ops.size,
+                2,
+            ), "args should be a numpy array of shape (M, 2)"
+            assert np.isin(
+                ops, [ADD_EDGE, REMOVE_EDGE]
+            ).all(), "Only edge maps can be encoded as arrays"
+            assert (
+                (args >= 0) & (args < self._n)
+            ).all(), "Encoded maps refer to nodes outside the system"
+            return
+
         # Assert that maps is a list
         assert isinstance(maps, list), "maps should be a list"
 
@@ -49,10 +229,15 @@ class System:
             assert isinstance(mi, list), "Each map instruction should be a list"
             assert len(mi) == 2, "Each map instruction should contain two elements"
 
-            # Assert that the first element of each inner list is a string and is a key in self.maps
+            # Assert that the first element of each inner list is a key in self.maps or its op code
+            # bool is an int subclass, so True would silently dispatch to op code 1
+            key = mi[0]
+            valid_key = type(key) is not bool and isinstance(
+                key, (str, int, np.integer)
+            )
             assert (
-                isinstance(mi[0], str) and mi[0] in self.maps
-            ), f"The first element of each map instruction should be a string and a key in the available maps. Found:\
+                valid_key and key in self._dispatch
+            ), f"The first element of each map instruction should be a key in the available maps or its op code. Found:\
                  {mi[0]}"
 
             assert isinstance(
@@ -60,19 +245,26 @@ class System:
             ), "the second element in the map instruction is a tuple"
             # Assert that the rest of the elements in the inner list match the expected arguments for the map function
             # This is a basic check; for more complex validation, you might need custom validation per map type
-            expected_args_count = (
-                self.maps[mi[0]].__code__.co_argcount - 1
-            )  # -1 to exclude 'self'
-            actual_args_count = len(mi[1])  # -1 to exclude the map key
+            expected_args_count = self._map_arity[mi[0]]
+            actual_args_count = len(mi[1])
             assert (
                 actual_args_count == expected_args_count
             ), f"Map function '{mi[0]}' expects {expected_args_count} arguments, but {actual_args_count} were given"
 
-            # Apply the map
-            self.maps[mi[0]](*mi[1])
-
     def get_size(self):
-        return self.nodes.shape[0]
+        return self._n
+
+    def is_sparse(self):
+        return self._sparse
+
+    def local_state_key(self, i: int):
+        """
+        Get a hashable key describing the state of a node.
+
+        :param i: Index of the node.
+        :return: A tuple with the properties of the node.
+        """
+        return tuple(self.nodes[i].tolist())
 
     def _add_edge(self, n1: int, n2: int):
         """
@@ -81,12 +273,7 @@ class System:
         :param n1: Index of the first node.
         :param n2: Index of the second node.
         """
-        if n1 == n2:
-            raise ValueError("Cannot connect a node to itself")
-        if self.adj[n1][n2] == 1 or self.adj[n2][n1] == 1:
-            raise ValueError("Attempting to add an edge that is already present")
-        self.adj[n1][n2] += 1
-        self.adj[n2][n1] += 1
+        _add_edge_impl(self.adj, n1, n2)
 
     def _remove_edge(self, n1: int, n2: int):
         """
@@ -95,12 +282,7 @@ class System:
         :param n1: Index of the first node.
         :param n2: Index of the second node.
         """
-        if n1 == n2:
-            raise ValueError("Cannot disconnect a node from itself")
-        if self.adj[n1][n2] == 0 or self.adj[n2][n1] == 0:
-            raise ValueError("Attempting to remove an edge that doesn't exist")
-        self.adj[n1][n2] -= 1
-        self.adj[n2][n1] -= 1
+        _remove_edge_impl(self.adj, n1, n2)
 
     def _change_node_property(self, n1: int, y):
         """
@@ -110,8 +292,8 @@ class System:
         :param y: A numpy array representing the new property of the node.
         """
         # Ensure y has the correct dimensions
-        y = np.array(y)
+        y = self.xp.asarray(y)
         assert (
-            y.shape[0] == self.nodes.shape[1]
+            y.shape[0] == self._d
         ), "New property dimensions must match the existing property dimensions"
         self.nodes[n1] = y
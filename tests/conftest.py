@@ -0,0 +1,11 @@
+import os
+import sys
+import types
+
+# The modules import each other by their file names, and Model also as Code.System
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "networkD"))
+
+import System  # noqa: E402
+
+sys.modules.setdefault("Code", types.ModuleType("Code")).System = System
+sys.modules["Code.System"] = System
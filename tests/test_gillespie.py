@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+import Model
+import System
+from InterAction import InterAction
+
+
+def rate_add(i: int, j: int, S: System.System, *, k):
+    return k if S.adj[i, j] == 0 else 0.0
+
+
+def map_add(i, j, S):
+    return [["+", (i, j)]]
+
+
+def rate_remove(i: int, j: int, S: System.System):
+    return 0.5 if S.adj[i, j] else 0.0
+
+
+def map_remove(i, j, S):
+    return (np.array([System.REMOVE_EDGE], dtype=np.int8), np.array([[i, j]]))
+
+
+def update_pair(S, maps) -> np.ndarray:
+    # Both rates of a pair only depend on the edge between its two nodes
+    mask = np.zeros((S.get_size(),) * 2, dtype=bool)
+    if isinstance(maps, tuple):
+        pairs = maps[1]
+    else:
+        pairs = [args for _, args in maps]
+    for i, j in pairs:
+        mask[i, j] = True
+    return mask
+
+
+def make_model(n=6, **kwargs):
+    interactions = [
+        InterAction(
+            rate_func=rate_add, map_func=map_add, update_func=update_pair, k=1.0
+        ),
+        InterAction(
+            rate_func=rate_remove, map_func=map_remove, update_func=update_pair
+        ),
+    ]
+    model = Model.Model(interactions, np.random.rand(n, 2), **kwargs)
+    model.simulation.rng = np.random.default_rng(0)
+    return model
+
+
+def test_masked_refresh_matches_full_recompute():
+    model = make_model()
+    sim = model.simulation
+    for _ in range(200):
+        assert model.step() is not None
+        sim._compute_rates()
+        for k, interaction in enumerate(model.interactions):
+            full = interaction.get_propensity_matrix(model.system)
+            np.testing.assert_allclose(sim._blocks[k], full[sim._upper])
+
+
+@pytest.mark.parametrize("n", [2, 3, 7, 40])
+def test_pair_matches_triu_indices(n):
+    sim = Model.Model([], np.zeros((n, 1))).simulation
+    rows, cols = np.triu_indices(n, k=1)
+    assert [sim._pair(p) for p in range(sim._n_pairs)] == list(zip(rows, cols))
+
+
+def test_run_stops_before_overshooting_event():
+    model = make_model()
+    model.run(2.0)
+    replay = make_model()
+    replay.system.nodes[:] = model.system.nodes
+    time = 0.0
+    while True:
+        dt, k, i, j = replay.simulation.draw()
+        if time + dt > 2.0:
+            break
+        replay.simulation.apply(dt, k, i, j)
+        time += dt
+
+    assert model.time == 2.0
+    np.testing.assert_array_equal(model.system.adj, replay.system.adj)
+
+
+def test_run_without_events_before_t_max():
+    interactions = [InterAction(rate_func=rate_add, map_func=map_add, k=1e-12)]
+    model = Model.Model(interactions, np.zeros((4, 1)))
+    model.run(1.0)
+    assert model.time == 1.0
+    np.testing.assert_array_equal(model.system.adj, np.eye(4))
+
+
+def test_zero_rates_are_never_selected():
+    def rate_first(i: int, j: int, S: System.System):
+        return 1.0 if i == 0 else 0.0
+
+    def rate_none(i: int, j: int, S: System.System):
+        return 0.0
+
+    interactions = [
+        InterAction(rate_func=rate_none, map_func=map_add),
+        InterAction(rate_func=rate_first, map_func=map_add),
+    ]
+    sim = Model.Model(interactions, np.zeros((8, 1))).simulation
+    sim.rng = np.random.default_rng(0)
+    for _ in range(2000):
+        _, k, i, j = sim.draw()
+        assert (k, i) == (1, 0) and 0 < j < 8
+
+
+def test_no_event_when_all_rates_are_zero():
+    def rate_none(i: int, j: int, S: System.System):
+        return 0.0
+
+    model = Model.Model(
+        [InterAction(rate_func=rate_none, map_func=map_add)], np.zeros((3, 1))
+    )
+    assert model.step() is None
+
+
+@pytest.mark.parametrize("is_sparse", [False, True])
+def test_encoded_maps_match_list_maps(is_sparse):
+    n = 10
+    adj = np.eye(n, dtype=np.int8)
+    if is_sparse:
+        sparse = pytest.importorskip("scipy.sparse")
+        adj = sparse.csr_matrix(adj)
+    listed = System.System(np.zeros((n, 1)), adj)
+    encoded = System.System(np.zeros((n, 1)), adj)
+
+    rng = np.random.default_rng(0)
+    edges = set()
+    for _ in range(300):
+        i, j = sorted(rng.choice(n, size=2, replace=False))
+        key = "-" if (i, j) in edges else "+"
+        edges ^= {(i, j)}
+        listed.apply_maps([[key, (i, j)]])
+        encoded.apply_maps(
+            (np.array([System.OP_CODES[key]], dtype=np.int8), np.array([[i, j]]))
+        )
+
+    expected, actual = listed.adj, encoded.adj
+    if is_sparse:
+        expected, actual = expected.toarray(), actual.toarray()
+    np.testing.assert_array_equal(actual, expected)
+    assert np.count_nonzero(np.triu(actual, k=1)) == len(edges)